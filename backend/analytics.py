@@ -0,0 +1,348 @@
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+from models import TimerSession
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+UNASSIGNED_SUBJECT = "Unassigned"
+
+# Focus-time distribution buckets: (field, upper bound in minutes)
+FOCUS_BUCKETS = [
+    ("under_15", 15),
+    ("15_to_30", 30),
+    ("30_to_60", 60),
+    ("60_plus", None),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def focus_bucket(duration_seconds: int) -> str:
+    """Get the focus-time bucket a session of the given length falls into"""
+    minutes = duration_seconds / 60
+    for field, upper in FOCUS_BUCKETS:
+        if upper is None or minutes < upper:
+            return field
+    return FOCUS_BUCKETS[-1][0]
+
+
+def session_date(start_time: str) -> Optional[str]:
+    """Get the UTC date (YYYY-MM-DD) a session started on, or None if start_time is not ISO 8601.
+
+    Buckets are keyed by UTC date; the frontend sends start_time as UTC and
+    naive timestamps are treated as UTC.
+    """
+    try:
+        started = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if started.tzinfo is not None:
+        started = started.astimezone(timezone.utc)
+    return started.strftime('%Y-%m-%d')
+
+
+def date_range(start: Optional[str], end: Optional[str]) -> Tuple[str, str]:
+    """Resolve optional YYYY-MM-DD bounds into an inclusive range, defaulting to the last 30 UTC days"""
+    end_date = datetime.strptime(end, '%Y-%m-%d') if end else datetime.now(timezone.utc).replace(tzinfo=None)
+    start_date = datetime.strptime(start, '%Y-%m-%d') if start else end_date - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start_date > end_date:
+        raise ValueError("start must not be after end")
+    if (end_date - start_date).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"date range must not exceed {MAX_RANGE_DAYS} days")
+    return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+
+async def ensure_indexes(db):
+    """Create the indexes the daily bucket upserts, range queries and subject lookups rely on"""
+    await db.timer_session_daily.create_index(
+        [("user_id", 1), ("date", 1), ("subject", 1)],
+        unique=True
+    )
+    await db.tasks.create_index("id")
+    await db.assignments.create_index("id")
+
+
+async def session_subject(db, session: TimerSession) -> str:
+    """Resolve the subject of a session through its task's assignment"""
+    if not session.task_id:
+        return UNASSIGNED_SUBJECT
+    task = await db.tasks.find_one(
+        {"id": session.task_id, "user_id": session.user_id},
+        {"assignment_id": 1}
+    )
+    if not task:
+        return UNASSIGNED_SUBJECT
+    assignment = await db.assignments.find_one(
+        {"id": task["assignment_id"], "user_id": session.user_id},
+        {"subject": 1}
+    )
+    return assignment["subject"] if assignment else UNASSIGNED_SUBJECT
+
+
+async def record_session(db, session: TimerSession):
+    """Fold a timer session into its user's daily bucket for the session's date and subject.
+
+    Analytics are best-effort: failures are logged rather than raised so they
+    never fail the session or wallet update.
+    """
+    date = session_date(session.start_time)
+    if date is None:
+        logger.warning("Not recording session %s in analytics: invalid start_time %r", session.id, session.start_time)
+        return
+    try:
+        subject = await session_subject(db, session)
+        query = {"user_id": session.user_id, "date": date, "subject": subject}
+        update = {"$inc": {
+            "seconds": session.duration,
+            "sessions": 1,
+            "points": session.points_earned,
+            f"focus.{focus_bucket(session.duration)}": 1
+        }}
+        try:
+            await db.timer_session_daily.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent upsert created the bucket first; it now exists to be updated
+            await db.timer_session_daily.update_one(query, update, upsert=True)
+    except Exception:
+        logger.exception("Failed to record session %s in analytics", session.id)
+
+
+# Sessions inserted with this flag are counted live by record_session; the backfill skips them
+LIVE_FLAG = "bucketed_live"
+BACKFILL_MARKER = "timer_session_backfill"
+
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def _focus_counts() -> dict:
+    counts = {}
+    lower = 0
+    for field, upper in FOCUS_BUCKETS:
+        conditions = [{"$gte": ["$duration", lower * 60]}]
+        if upper is not None:
+            conditions.append({"$lt": ["$duration", upper * 60]})
+        counts[field] = {"$sum": {"$cond": [{"$and": conditions}, 1, 0]}}
+        lower = upper
+    return counts
+
+
+def backfill_pipeline() -> List[dict]:
+    """Fold sessions recorded before live bucketing into the buckets' ``legacy`` counts.
+
+    The counts are written to a separate sub-document that live updates never
+    touch, so rerunning the backfill (or two workers running it at once) sets
+    the same values instead of double counting.
+    """
+    return [
+        {"$match": {LIVE_FLAG: {"$ne": True}}},
+        {"$addFields": {"_started": {"$dateFromString": {
+            "dateString": "$start_time", "onError": None, "onNull": None
+        }}}},
+        {"$match": {"_started": {"$ne": None}}},
+        # Equality lookups on the indexed id fields rather than correlated $expr pipelines
+        {"$lookup": {"from": "tasks", "localField": "task_id", "foreignField": "id", "as": "_task"}},
+        {"$addFields": {"_task": {"$filter": {
+            "input": "$_task", "cond": {"$eq": ["$$this.user_id", "$user_id"]}
+        }}}},
+        {"$addFields": {"_assignment_id": {"$arrayElemAt": ["$_task.assignment_id", 0]}}},
+        {"$lookup": {"from": "assignments", "localField": "_assignment_id", "foreignField": "id", "as": "_assignment"}},
+        {"$addFields": {"_assignment": {"$filter": {
+            "input": "$_assignment", "cond": {"$eq": ["$$this.user_id", "$user_id"]}
+        }}}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$_started", "timezone": "UTC"}},
+                "subject": {"$ifNull": [{"$arrayElemAt": ["$_assignment.subject", 0]}, UNASSIGNED_SUBJECT]}
+            },
+            "seconds": {"$sum": "$duration"},
+            "sessions": {"$sum": 1},
+            "points": {"$sum": "$points_earned"},
+            **_focus_counts()
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "date": "$_id.date",
+            "subject": "$_id.subject",
+            "legacy": {
+                "seconds": "$seconds",
+                "sessions": "$sessions",
+                "points": "$points",
+                "focus": {field: f"${field}" for field, _ in FOCUS_BUCKETS}
+            }
+        }},
+        {"$merge": {
+            "into": "timer_session_daily",
+            "on": ["user_id", "date", "subject"],
+            "whenMatched": [{"$set": {"legacy": "$$new.legacy"}}],
+            "whenNotMatched": "insert"
+        }},
+    ]
+
+
+async def backfill_buckets(db):
+    """Build legacy bucket counts from existing timer sessions, once per database.
+
+    Errors are logged rather than raised; the backfill is idempotent, so it
+    simply runs again on the next startup.
+    """
+    try:
+        if await db.analytics_meta.find_one({"_id": BACKFILL_MARKER}):
+            return
+        await db.timer_sessions.aggregate(backfill_pipeline(), allowDiskUse=True).to_list(length=None)
+        await db.analytics_meta.update_one(
+            {"_id": BACKFILL_MARKER},
+            {"$set": {"completed_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        logger.info("Backfilled timer session analytics buckets")
+    except Exception:
+        logger.exception("Timer session analytics backfill failed")
+
+
+def start_backfill(db):
+    """Run the backfill in the background so startup does not wait for it"""
+    global _backfill_task
+    if _backfill_task is None or _backfill_task.done():
+        _backfill_task = asyncio.ensure_future(backfill_buckets(db))
+
+
+def _counts(field: str) -> dict:
+    # Live counts plus any backfilled legacy counts
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, {"$ifNull": [f"$legacy.{field}", 0]}]}
+
+
+def _match(user_id: str, start: str, end: str) -> dict:
+    return {"$match": {"user_id": user_id, "date": {"$gte": start, "$lte": end}}}
+
+
+def _totals() -> dict:
+    return {
+        "seconds": {"$sum": _counts("seconds")},
+        "sessions": {"$sum": _counts("sessions")},
+        "points": {"$sum": _counts("points")},
+    }
+
+
+def _project_minutes(key: str) -> dict:
+    return {"$project": {
+        "_id": 0,
+        key: "$_id",
+        "minutes": {"$round": [{"$divide": ["$seconds", 60]}, 1]},
+        "sessions": 1,
+        "points": 1,
+    }}
+
+
+def daily_pipeline(user_id: str, start: str, end: str) -> List[dict]:
+    return [
+        _match(user_id, start, end),
+        {"$group": {"_id": "$date", **_totals()}},
+        {"$sort": {"_id": 1}},
+        _project_minutes("date"),
+    ]
+
+
+def weekly_pipeline(user_id: str, start: str, end: str) -> List[dict]:
+    day = {"$dateFromString": {"dateString": "$date", "format": "%Y-%m-%d"}}
+    return [
+        _match(user_id, start, end),
+        {"$group": {
+            "_id": {"year": {"$isoWeekYear": day}, "week": {"$isoWeek": day}},
+            **_totals()
+        }},
+        {"$sort": {"_id.year": 1, "_id.week": 1}},
+        {"$project": {
+            "_id": 0,
+            "year": "$_id.year",
+            "week": "$_id.week",
+            # Monday of the ISO week, even if the range starts mid-week
+            "week_start": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$dateFromParts": {
+                "isoWeekYear": "$_id.year", "isoWeek": "$_id.week", "isoDayOfWeek": 1
+            }}}},
+            "minutes": {"$round": [{"$divide": ["$seconds", 60]}, 1]},
+            "sessions": 1,
+            "points": 1,
+        }},
+    ]
+
+
+def subject_pipeline(user_id: str, start: str, end: str) -> List[dict]:
+    return [
+        _match(user_id, start, end),
+        {"$group": {"_id": "$subject", **_totals()}},
+        {"$sort": {"seconds": -1}},
+        _project_minutes("subject"),
+    ]
+
+
+def focus_distribution_pipeline(user_id: str, start: str, end: str) -> List[dict]:
+    return [
+        _match(user_id, start, end),
+        {"$group": {
+            "_id": None,
+            **{field: {"$sum": _counts(f"focus.{field}")} for field, _ in FOCUS_BUCKETS}
+        }},
+        {"$project": {"_id": 0}},
+    ]
+
+
+def active_days_pipeline(user_id: str, start: str, end: str) -> List[dict]:
+    return [
+        _match(user_id, start, end),
+        {"$group": {"_id": "$date", "seconds": {"$sum": _counts("seconds")}}},
+        {"$match": {"seconds": {"$gt": 0}}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def longest_streak(active_days: List[str]) -> int:
+    """Get the longest run of consecutive days in an ascending list of active dates"""
+    longest = 0
+    run = 0
+    previous = None
+    for date in active_days:
+        day = datetime.strptime(date, '%Y-%m-%d')
+        run = run + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    return longest
+
+
+async def current_streak(db, user_id: str, end: str) -> int:
+    """Count consecutive active days ending on end (or the day before), ignoring any range start.
+
+    Walks the buckets backwards by date and stops at the first gap, so the
+    cost depends on the streak length rather than the user's full history.
+    """
+    end_day = datetime.strptime(end, '%Y-%m-%d')
+    # A streak is still alive if the user has not studied yet on the end day
+    expected = None
+    streak = 0
+    cursor = db.timer_session_daily.find(
+        {
+            "user_id": user_id,
+            "date": {"$lte": end},
+            "$or": [{"seconds": {"$gt": 0}}, {"legacy.seconds": {"$gt": 0}}]
+        },
+        {"date": 1}
+    ).sort("date", -1)
+    async for bucket in cursor:
+        day = datetime.strptime(bucket["date"], '%Y-%m-%d')
+        if expected is None:
+            if end_day - day > timedelta(days=1):
+                break
+        elif day == expected + timedelta(days=1):
+            # Another subject's bucket on the day just counted
+            continue
+        elif day != expected:
+            break
+        streak += 1
+        expected = day - timedelta(days=1)
+    return streak
@@ -0,0 +1,336 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import hashlib
+import itertools
+import logging
+import secrets
+import time
+
+from models import Assignment, Task
+
+PRODID = "-//Deadliner AI//Calendar Feed//EN"
+MAX_WINDOWS_PER_USER = 8
+IDLE_SECONDS = 24 * 60 * 60
+MAX_USERS = 10000
+# Upper bound on how long a rendering is trusted without reloading, which also bounds
+# staleness from writes handled by other workers or writes whose invalidation was missed
+FRESH_SECONDS = 10 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(text: str) -> str:
+    """Escape text for an iCalendar TEXT value (RFC 5545 3.3.11)"""
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Fold a content line to 75 octets as required by RFC 5545"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    chunk = b""
+    for char in line:
+        char_bytes = char.encode("utf-8")
+        limit = 75 if not parts else 74
+        if len(chunk) + len(char_bytes) > limit:
+            parts.append(chunk.decode("utf-8"))
+            chunk = b""
+        chunk += char_bytes
+    parts.append(chunk.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+
+def _event_date(value: str) -> str:
+    """Normalise an ISO date or datetime string to YYYY-MM-DD"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+
+
+def _render_event(uid: str, date: str, summary: str, description: str, stamp: str, completed: bool) -> str:
+    start = datetime.strptime(date, '%Y-%m-%d')
+    end = start + timedelta(days=1)
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}@deadliner-ai",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{end.strftime('%Y%m%d')}",
+        f"SUMMARY:{_escape(summary)}",
+        f"DESCRIPTION:{_escape(description)}",
+        f"STATUS:{'COMPLETED' if completed else 'CONFIRMED'}",
+        "TRANSP:TRANSPARENT",
+        "END:VEVENT",
+    ]
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+def render_task_event(task: Task, stamp: str) -> Tuple[str, str]:
+    """Render a task as an all-day VEVENT, returning (date, vevent)"""
+    description = f"{task.description} ({task.duration} min, {task.priority} priority)"
+    event = _render_event(f"task-{task.id}", task.scheduled_date, task.title, description, stamp, task.completed)
+    return task.scheduled_date, event
+
+
+def render_assignment_event(assignment: Assignment, stamp: str) -> Tuple[str, str]:
+    """Render an assignment due date as an all-day VEVENT, returning (date, vevent)"""
+    date = _event_date(assignment.due_date)
+    summary = f"⏰ Due: {assignment.title} ({assignment.subject})"
+    description = assignment.description or f"{assignment.type.capitalize()} for {assignment.subject}"
+    event = _render_event(f"assignment-{assignment.id}", date, summary, description, stamp, assignment.completed)
+    return date, event
+
+
+class _FeedEntry:
+    def __init__(self, generation: int):
+        self.loaded = False
+        self.loaded_at = 0.0
+        # Replaced on every invalidation so a load that raced a write is not marked fresh
+        self.generation = generation
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.last_access = time.monotonic()
+        # document key -> (fingerprint, date, rendered VEVENT)
+        self.events: Dict[str, Tuple[str, str, str]] = {}
+        # (start, end) window -> (etag, body), least recently used first
+        self.bodies: "OrderedDict[Tuple[Optional[str], Optional[str]], Tuple[str, str]]" = OrderedDict()
+
+
+class CalendarFeedCache:
+    """Per-user cache of rendered calendar feeds.
+
+    Write endpoints call ``invalidate`` for the affected user. Until then a
+    feed request is answered from the cached body (or with a 304) without
+    querying MongoDB. After an invalidation the documents are reloaded, but
+    only events whose content changed are re-rendered. The cache lives in
+    process memory, so each worker keeps its own copy and only sees its own
+    invalidations; a rendering older than ``fresh_seconds`` is reloaded on
+    the next request regardless. Each user keeps at most ``max_windows``
+    rendered windows, and users idle for longer than ``idle_seconds`` are
+    evicted.
+    """
+
+    def __init__(self, max_windows: int = MAX_WINDOWS_PER_USER, idle_seconds: float = IDLE_SECONDS,
+                 max_users: int = MAX_USERS, fresh_seconds: float = FRESH_SECONDS):
+        self.max_windows = max_windows
+        self.idle_seconds = idle_seconds
+        self.max_users = max_users
+        self.fresh_seconds = fresh_seconds
+        # user_id -> entry, least recently used first
+        self._entries: "OrderedDict[str, _FeedEntry]" = OrderedDict()
+        # Generations are unique across users so a recreated entry never matches an old one
+        self._generations = itertools.count()
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if entry.last_access >= cutoff and len(self._entries) <= self.max_users:
+                break
+            del self._entries[user_id]
+
+    def _get(self, user_id: str) -> Optional[_FeedEntry]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+            self._entries.move_to_end(user_id)
+        return entry
+
+    def _entry(self, user_id: str) -> _FeedEntry:
+        entry = self._get(user_id)
+        if entry is None:
+            self._evict()
+            entry = _FeedEntry(next(self._generations))
+            self._entries[user_id] = entry
+        return entry
+
+    def _is_fresh(self, entry: _FeedEntry) -> bool:
+        return entry.loaded and time.monotonic() - entry.loaded_at < self.fresh_seconds
+
+    def _bump_last_modified(self, entry: _FeedEntry):
+        # Keep Last-Modified strictly increasing so changes within one second are still visible
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        entry.last_modified = max(now, entry.last_modified + timedelta(seconds=1))
+
+    def invalidate(self, user_id: str):
+        """Mark a user's feed as stale after their tasks or assignments changed"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            # Nothing cached; the next feed request loads from scratch
+            return
+        entry.loaded = False
+        entry.generation = next(self._generations)
+        entry.bodies.clear()
+        self._bump_last_modified(entry)
+
+    def is_loaded(self, user_id: str) -> bool:
+        entry = self._get(user_id)
+        return entry is not None and self._is_fresh(entry)
+
+    def generation(self, user_id: str) -> int:
+        """Get the current generation, to be passed to ``load`` after the documents are fetched"""
+        return self._entry(user_id).generation
+
+    def cached_body(self, user_id: str, start: Optional[str], end: Optional[str]) -> Optional[Tuple[str, str]]:
+        """Return the cached (etag, body) for a window if the feed is still fresh"""
+        entry = self._get(user_id)
+        if entry is None or not self._is_fresh(entry):
+            return None
+        window = (start, end)
+        if window not in entry.bodies:
+            return None
+        entry.bodies.move_to_end(window)
+        return entry.bodies[window]
+
+    def last_modified(self, user_id: str) -> datetime:
+        return self._entry(user_id).last_modified
+
+    def load(self, user_id: str, generation: int, assignments: List[Assignment], tasks: List[Task]):
+        """Refresh the cached events from documents fetched at ``generation``.
+
+        Events whose fingerprint is unchanged keep their previous rendering.
+        Documents with unparseable dates are logged and left out of the feed.
+        If the feed was invalidated while the documents were being fetched,
+        the events are still kept for reuse but the feed stays stale. If a
+        reload finds changes this worker was not told about, Last-Modified
+        is advanced so If-Modified-Since clients see them.
+        """
+        entry = self._entry(user_id)
+        previous = {key: cached[0] for key, cached in entry.events.items()}
+        reloading = entry.loaded_at > 0
+        stamp = entry.last_modified.strftime('%Y%m%dT%H%M%SZ')
+        events = {}
+        for key, doc, render in (
+            [(f"assignment-{a.id}", a, render_assignment_event) for a in assignments]
+            + [(f"task-{t.id}", t, render_task_event) for t in tasks]
+        ):
+            fingerprint = hashlib.sha1(doc.model_dump_json().encode("utf-8")).hexdigest()
+            cached = entry.events.get(key)
+            if cached and cached[0] == fingerprint:
+                events[key] = cached
+                continue
+            try:
+                date, event = render(doc, stamp)
+            except ValueError as e:
+                logger.warning("Skipping %s in calendar feed for %s: %s", key, user_id, e)
+                continue
+            events[key] = (fingerprint, date, event)
+        if reloading and previous != {key: cached[0] for key, cached in events.items()}:
+            self._bump_last_modified(entry)
+        entry.events = events
+        entry.bodies.clear()
+        entry.loaded = entry.generation == generation
+        entry.loaded_at = time.monotonic()
+
+    def render(self, user_id: str, start: Optional[str], end: Optional[str]) -> Tuple[str, str]:
+        """Assemble the VCALENDAR body for a date window, caching it with its ETag while the feed is fresh"""
+        entry = self._entry(user_id)
+        window = (start, end)
+        if window in entry.bodies:
+            entry.bodies.move_to_end(window)
+            return entry.bodies[window]
+
+        selected = sorted(
+            (date, key, event)
+            for key, (_, date, event) in entry.events.items()
+            if (start is None or date >= start) and (end is None or date <= end)
+        )
+        header = "\r\n".join([
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{PRODID}",
+            "CALSCALE:GREGORIAN",
+            "METHOD:PUBLISH",
+            "X-WR-CALNAME:Deadliner AI",
+        ]) + "\r\n"
+        body = header + "".join(event for _, _, event in selected) + "END:VCALENDAR\r\n"
+        etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+        if entry.loaded:
+            entry.bodies[window] = (etag, body)
+            while len(entry.bodies) > self.max_windows:
+                entry.bodies.popitem(last=False)
+        return etag, body
+
+
+def http_date(value: datetime) -> str:
+    """Format a datetime for the Last-Modified header"""
+    return format_datetime(value, usegmt=True)
+
+
+def not_modified_since(if_modified_since: Optional[str], last_modified: datetime) -> bool:
+    """Check an If-Modified-Since header against the feed's Last-Modified time"""
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified <= since
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against a strong ETag"""
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def new_token() -> str:
+    """Generate a secret token for a user's calendar subscription URL"""
+    return secrets.token_urlsafe(32)
+
+
+class CalendarTokenCache:
+    """Bounded cache of calendar token -> user id lookups.
+
+    Lets repeat polls authenticate without a database query. Entries expire
+    after ``ttl_seconds`` so a token rotated on another worker stops working
+    there too.
+    """
+
+    def __init__(self, ttl_seconds: float = FRESH_SECONDS, max_tokens: int = MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_tokens = max_tokens
+        # token -> (user_id, expiry), oldest first
+        self._tokens: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[str]:
+        cached = self._tokens.get(token)
+        if cached is None:
+            return None
+        user_id, expiry = cached
+        if time.monotonic() >= expiry:
+            del self._tokens[token]
+            return None
+        return user_id
+
+    def put(self, token: str, user_id: str):
+        self._tokens.pop(token, None)
+        self._tokens[token] = (user_id, time.monotonic() + self.ttl_seconds)
+        while len(self._tokens) > self.max_tokens:
+            self._tokens.popitem(last=False)
+
+    def forget_user(self, user_id: str):
+        """Drop every cached token of a user, e.g. after rotating it"""
+        for token in [token for token, (owner, _) in self._tokens.items() if owner == user_id]:
+            del self._tokens[token]
+
+
+async def ensure_indexes(db):
+    """Create the index used to look users up by calendar token"""
+    await db.users.create_index("calendar_token", unique=True, sparse=True)
+
+
+calendar_cache = CalendarFeedCache()
+calendar_tokens = CalendarTokenCache()
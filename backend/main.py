@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -12,9 +12,16 @@ from dotenv import load_dotenv
 from database import connect_to_mongo, close_mongo_connection, get_database
 from models import (
     Assignment, AssignmentCreate, Task, TaskCreate, StudyProfile, 
-    User, TimerSession, UserWallet, RewardRedemption, DailyPlan
+    User, TimerSession, UserWallet, RewardRedemption, DailyPlan,
+    SimulationRequest, SimulationResult
 )
 from ai_scheduler import AIScheduler
+from calendar_feed import (
+    calendar_cache, calendar_tokens, new_token, etag_matches, http_date, not_modified_since,
+    ensure_indexes as ensure_calendar_indexes
+)
+from schedule_simulator import simulate, start_executor, shutdown_executor
+import analytics
 
 load_dotenv()
 
@@ -35,9 +42,14 @@ security = HTTPBearer()
 @app.on_event("startup")
 async def startup_event():
     await connect_to_mongo()
+    await analytics.ensure_indexes(get_database())
+    await ensure_calendar_indexes(get_database())
+    analytics.start_backfill(get_database())
+    await start_executor()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    shutdown_executor()
     await close_mongo_connection()
 
 # Dependency to get database
@@ -49,6 +61,18 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     # In a real app, you'd validate the JWT token here
     return {"id": "demo_user", "email": "demo@example.com", "name": "Demo User"}
 
+# Calendar apps cannot send an Authorization header, so feeds are authenticated
+# by a per-user secret token in the subscription URL
+async def get_calendar_user(token: str = Query(...), db=Depends(get_db)):
+    user_id = calendar_tokens.get(token)
+    if user_id is None:
+        user = await db.users.find_one({"calendar_token": token}, {"id": 1})
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid calendar token")
+        user_id = user["id"]
+        calendar_tokens.put(token, user_id)
+    return {"id": user_id}
+
 # Routes
 
 @app.get("/")
@@ -104,6 +128,9 @@ async def create_assignment(
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating assignment: {str(e)}")
+    finally:
+        # Invalidate even after a partial write so the feed never keeps serving the old state
+        calendar_cache.invalidate(current_user["id"])
 
 @app.get("/api/assignments", response_model=List[Assignment])
 async def get_assignments(
@@ -154,6 +181,8 @@ async def complete_task(
         return {"message": "Task completed successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error completing task: {str(e)}")
+    finally:
+        calendar_cache.invalidate(current_user["id"])
 
 @app.put("/api/tasks/{task_id}/reschedule")
 async def reschedule_task(
@@ -175,6 +204,8 @@ async def reschedule_task(
         return {"message": "Task rescheduled successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error rescheduling task: {str(e)}")
+    finally:
+        calendar_cache.invalidate(current_user["id"])
 
 @app.get("/api/daily-plan/{date}")
 async def get_daily_plan(
@@ -194,6 +225,129 @@ async def get_daily_plan(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching daily plan: {str(e)}")
 
+async def _set_calendar_token(db, current_user: dict, token: str):
+    await db.users.update_one(
+        {"id": current_user["id"]},
+        {
+            "$set": {"calendar_token": token},
+            "$setOnInsert": {
+                "email": current_user["email"],
+                "name": current_user["name"],
+                "study_profile": StudyProfile().dict(),
+                "created_at": datetime.now().isoformat()
+            }
+        },
+        upsert=True
+    )
+
+@app.get("/api/calendar/token")
+async def get_calendar_token(
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Get the user's calendar subscription token, creating one if needed"""
+    try:
+        user = await db.users.find_one({"id": current_user["id"]}, {"calendar_token": 1})
+        token = user.get("calendar_token") if user else None
+        if not token:
+            token = new_token()
+            await _set_calendar_token(db, current_user, token)
+        return {"token": token, "url": f"/api/calendar.ics?token={token}"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching calendar token: {str(e)}")
+
+@app.post("/api/calendar/token/rotate")
+async def rotate_calendar_token(
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Replace the user's calendar subscription token, revoking the old URL"""
+    try:
+        token = new_token()
+        await _set_calendar_token(db, current_user, token)
+        calendar_tokens.forget_user(current_user["id"])
+        return {"token": token, "url": f"/api/calendar.ics?token={token}"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rotating calendar token: {str(e)}")
+
+@app.get("/api/calendar.ics")
+async def get_calendar_feed(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    db=Depends(get_db),
+    current_user=Depends(get_calendar_user)
+):
+    """Get an iCalendar feed of tasks and assignment due dates, optionally limited to a date window"""
+    for value in (start, end):
+        if value is not None:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD dates")
+    
+    try:
+        user_id = current_user["id"]
+        # Read before any reload so a write racing the queries cannot pair its newer
+        # Last-Modified with the older documents
+        last_modified = calendar_cache.last_modified(user_id)
+        
+        # Serve repeat polls from the cached rendering without touching the database
+        cached = calendar_cache.cached_body(user_id, start, end)
+        if cached is None:
+            if not calendar_cache.is_loaded(user_id):
+                generation = calendar_cache.generation(user_id)
+                assignments = []
+                async for assignment in db.assignments.find({"user_id": user_id}):
+                    assignment["_id"] = str(assignment["_id"])
+                    assignments.append(Assignment(**assignment))
+                tasks = []
+                async for task in db.tasks.find({"user_id": user_id}):
+                    task["_id"] = str(task["_id"])
+                    tasks.append(Task(**task))
+                calendar_cache.load(user_id, generation, assignments, tasks)
+            cached = calendar_cache.render(user_id, start, end)
+        
+        etag, body = cached
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(last_modified),
+            "Cache-Control": "private, no-cache",
+        }
+        
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+        if if_none_match is not None:
+            not_modified = etag_matches(if_none_match, etag)
+        else:
+            not_modified = not_modified_since(if_modified_since, last_modified)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        
+        return Response(content=body, media_type="text/calendar; charset=utf-8", headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating calendar feed: {str(e)}")
+
+@app.post("/api/schedule/simulate", response_model=List[SimulationResult])
+async def simulate_schedule(
+    request: SimulationRequest,
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Preview the load of candidate assignments against current tasks without saving anything"""
+    try:
+        user = await db.users.find_one({"id": current_user["id"]})
+        profile = StudyProfile(**user["study_profile"]) if user else StudyProfile()
+        
+        tasks = []
+        async for task in db.tasks.find({"user_id": current_user["id"], "completed": False}):
+            task["_id"] = str(task["_id"])
+            tasks.append(Task(**task))
+        
+        return await simulate(request.candidates, profile, tasks, current_user["id"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error simulating schedule: {str(e)}")
+
 @app.get("/api/profile", response_model=StudyProfile)
 async def get_profile(
     db=Depends(get_db),
@@ -237,7 +391,8 @@ async def create_timer_session(
         session.user_id = current_user["id"]
         session.id = str(uuid.uuid4())
         
-        await db.timer_sessions.insert_one(session.dict())
+        # Flagged so the legacy backfill never counts a session that record_session counts
+        await db.timer_sessions.insert_one({**session.dict(), analytics.LIVE_FLAG: True})
         
         # Update wallet points
         wallet = await db.wallets.find_one({"user_id": current_user["id"]})
@@ -254,6 +409,8 @@ async def create_timer_session(
             upsert=True
         )
         
+        await analytics.record_session(db, session)
+        
         return session
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating timer session: {str(e)}")
@@ -333,6 +490,104 @@ async def get_timer_sessions(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching timer sessions: {str(e)}")
 
+def _analytics_range(start: Optional[str], end: Optional[str]):
+    try:
+        return analytics.date_range(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date range: {str(e)}")
+
+@app.get("/api/analytics/daily")
+async def get_daily_analytics(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Get study minutes per day"""
+    start, end = _analytics_range(start, end)
+    try:
+        pipeline = analytics.daily_pipeline(current_user["id"], start, end)
+        days = await db.timer_session_daily.aggregate(pipeline).to_list(length=None)
+        return {"start": start, "end": end, "days": days}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching daily analytics: {str(e)}")
+
+@app.get("/api/analytics/weekly")
+async def get_weekly_analytics(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Get study minutes per ISO week"""
+    start, end = _analytics_range(start, end)
+    try:
+        pipeline = analytics.weekly_pipeline(current_user["id"], start, end)
+        weeks = await db.timer_session_daily.aggregate(pipeline).to_list(length=None)
+        return {"start": start, "end": end, "weeks": weeks}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching weekly analytics: {str(e)}")
+
+@app.get("/api/analytics/subjects")
+async def get_subject_analytics(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Get study minutes per subject"""
+    start, end = _analytics_range(start, end)
+    try:
+        pipeline = analytics.subject_pipeline(current_user["id"], start, end)
+        subjects = await db.timer_session_daily.aggregate(pipeline).to_list(length=None)
+        return {"start": start, "end": end, "subjects": subjects}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching subject analytics: {str(e)}")
+
+@app.get("/api/analytics/streaks")
+async def get_streak_analytics(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Get daily study streaks.
+
+    current_streak counts back from end regardless of start; longest_streak and
+    active_days only cover the requested range.
+    """
+    start, end = _analytics_range(start, end)
+    try:
+        pipeline = analytics.active_days_pipeline(current_user["id"], start, end)
+        active_days = [day["_id"] async for day in db.timer_session_daily.aggregate(pipeline)]
+        current = await analytics.current_streak(db, current_user["id"], end)
+        return {
+            "start": start,
+            "end": end,
+            "current_streak": current,
+            "longest_streak": max(analytics.longest_streak(active_days), current),
+            "active_days": len(active_days)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching streak analytics: {str(e)}")
+
+@app.get("/api/analytics/focus-distribution")
+async def get_focus_distribution(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Get the number of sessions in each focus-time bucket"""
+    start, end = _analytics_range(start, end)
+    try:
+        pipeline = analytics.focus_distribution_pipeline(current_user["id"], start, end)
+        result = await db.timer_session_daily.aggregate(pipeline).to_list(length=1)
+        distribution = result[0] if result else {field: 0 for field, _ in analytics.FOCUS_BUCKETS}
+        return {"start": start, "end": end, "distribution": distribution}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching focus distribution: {str(e)}")
+
 @app.get("/api/stats")
 async def get_stats(
     db=Depends(get_db),
@@ -392,6 +647,8 @@ async def delete_assignment(
         return {"message": "Assignment and associated tasks deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting assignment: {str(e)}")
+    finally:
+        calendar_cache.invalidate(current_user["id"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -86,4 +86,23 @@ class DailyPlan(BaseModel):
     date: str
     tasks: List[Task]
     total_study_time: int
-    completed: bool
\ No newline at end of file
+    completed: bool
+
+class SimulationRequest(BaseModel):
+    candidates: List[AssignmentCreate] = Field(..., max_length=50)
+
+class DayLoad(BaseModel):
+    date: str
+    existing_minutes: int
+    new_minutes: int
+    total_minutes: int
+    overloaded: bool
+
+class SimulationResult(BaseModel):
+    candidate: AssignmentCreate
+    tasks: List[Task]
+    daily_load: List[DayLoad]
+    overload_days: List[str]
+    scheduled_minutes: int
+    unscheduled_minutes: int
+    deadline_risk: str  # low, medium, high
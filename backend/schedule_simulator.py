@@ -0,0 +1,198 @@
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from models import Assignment, AssignmentCreate, StudyProfile, Task, DayLoad, SimulationResult
+from ai_scheduler import AIScheduler
+
+# Measured on a warm pool: evaluating a candidate takes ~0.5 ms, and a pool round
+# trip adds ~0.45 ms per chunk plus ~0.09 ms per candidate of pickling. With two
+# or more workers the pool breaks even at about three candidates.
+PARALLEL_THRESHOLD = 4
+MAX_WORKERS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+logger = logging.getLogger(__name__)
+
+# The server already runs motor/pymongo threads when the pool is created, so workers
+# must not be forked from it directly
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_executor: Optional[ProcessPoolExecutor] = None
+_warm_up_tasks = set()
+
+
+def _warm_up():
+    """No-op run in each worker so process startup and imports happen before the first request"""
+
+
+def _new_executor() -> ProcessPoolExecutor:
+    context = multiprocessing.get_context(START_METHOD)
+    if START_METHOD == "forkserver":
+        context.set_forkserver_preload([__name__])
+    return ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=context)
+
+
+async def _warm_up_executor(executor: ProcessPoolExecutor):
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(executor, _warm_up) for _ in range(MAX_WORKERS)])
+
+
+async def start_executor():
+    """Create and warm up the shared process pool; single-CPU hosts always evaluate inline"""
+    global _executor
+    if MAX_WORKERS == 1 or _executor is not None:
+        return
+    _executor = _new_executor()
+    try:
+        await _warm_up_executor(_executor)
+    except Exception:
+        logger.exception("Could not start the simulation process pool; evaluating inline")
+        shutdown_executor()
+
+
+async def _replace_executor():
+    """Replace a broken pool and warm the new one up in the background"""
+    global _executor
+    _executor = _new_executor()
+    task = asyncio.ensure_future(_warm_up_executor(_executor))
+    _warm_up_tasks.add(task)
+    task.add_done_callback(_warm_up_tasks.discard)
+
+
+def shutdown_executor():
+    """Shut down the shared process pool"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def existing_load(tasks: List[Task], today: str) -> Dict[str, int]:
+    """Sum the minutes of outstanding tasks per day from today onwards"""
+    load: Dict[str, int] = {}
+    for task in tasks:
+        if task.completed or task.scheduled_date < today:
+            continue
+        load[task.scheduled_date] = load.get(task.scheduled_date, 0) + task.duration
+    return load
+
+
+def evaluate_candidate(
+    candidate: AssignmentCreate,
+    index: int,
+    profile: StudyProfile,
+    load: Dict[str, int],
+    user_id: str,
+    today: str
+) -> SimulationResult:
+    """Break a candidate assignment into tasks and measure its effect on the user's load"""
+    assignment = Assignment(
+        id=f"simulation-{index}",
+        **candidate.model_dump(),
+        completed=False,
+        created_at=datetime.now().isoformat(),
+        user_id=user_id
+    )
+    tasks = AIScheduler.generate_task_breakdown(assignment, profile)
+
+    capacity = int(profile.daily_study_hours * 60)
+    due = datetime.fromisoformat(assignment.due_date.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+
+    new_load: Dict[str, int] = {}
+    for task in tasks:
+        new_load[task.scheduled_date] = new_load.get(task.scheduled_date, 0) + task.duration
+
+    daily_load = []
+    for date in sorted(set(new_load) | {d for d in load if d <= due}):
+        if date < today:
+            continue
+        existing_minutes = load.get(date, 0)
+        new_minutes = new_load.get(date, 0)
+        total = existing_minutes + new_minutes
+        daily_load.append(DayLoad(
+            date=date,
+            existing_minutes=existing_minutes,
+            new_minutes=new_minutes,
+            total_minutes=total,
+            overloaded=total > capacity
+        ))
+    overload_days = [day.date for day in daily_load if day.overloaded]
+
+    # Reminders are not work towards the assignment
+    scheduled_minutes = sum(task.duration for task in tasks if task.type != 'reminder')
+    unscheduled_minutes = max(0, int(assignment.estimated_hours * 60) - scheduled_minutes)
+    late_tasks = any(task.scheduled_date > due for task in tasks)
+    overloaded_work_days = [day.date for day in daily_load if day.overloaded and day.new_minutes > 0]
+
+    if late_tasks or unscheduled_minutes > scheduled_minutes * 0.2 or len(overloaded_work_days) > len(tasks) // 2:
+        deadline_risk = 'high'
+    elif unscheduled_minutes > 0 or overloaded_work_days:
+        deadline_risk = 'medium'
+    else:
+        deadline_risk = 'low'
+
+    return SimulationResult(
+        candidate=candidate,
+        tasks=tasks,
+        daily_load=daily_load,
+        overload_days=overload_days,
+        scheduled_minutes=scheduled_minutes,
+        unscheduled_minutes=unscheduled_minutes,
+        deadline_risk=deadline_risk
+    )
+
+
+def _evaluate_batch(
+    batch: List[tuple],
+    profile: StudyProfile,
+    load: Dict[str, int],
+    user_id: str,
+    today: str
+) -> List[dict]:
+    # Plain dicts pickle several times faster than the pydantic models
+    return [
+        evaluate_candidate(candidate, index, profile, load, user_id, today).model_dump()
+        for index, candidate in batch
+    ]
+
+
+async def simulate(
+    candidates: List[AssignmentCreate],
+    profile: StudyProfile,
+    tasks: List[Task],
+    user_id: str
+) -> List[dict]:
+    """Evaluate candidate assignments against the user's current tasks without persisting anything.
+
+    Larger batches are split into one chunk per worker so the profile and
+    existing load are pickled once per worker rather than once per candidate.
+    Small batches, single-CPU hosts and a broken pool fall back to running inline.
+    """
+    # Computed once so existing and new load are filtered against the same day
+    today = datetime.now().strftime('%Y-%m-%d')
+    load = existing_load(tasks, today)
+    indexed = list(enumerate(candidates))
+    executor = _executor
+    if executor is None or len(indexed) < PARALLEL_THRESHOLD:
+        return _evaluate_batch(indexed, profile, load, user_id, today)
+
+    size = -(-len(indexed) // MAX_WORKERS)
+    batches = [indexed[i:i + size] for i in range(0, len(indexed), size)]
+    loop = asyncio.get_running_loop()
+    try:
+        chunks = await asyncio.gather(*[
+            loop.run_in_executor(executor, _evaluate_batch, batch, profile, load, user_id, today)
+            for batch in batches
+        ])
+    except BrokenProcessPool:
+        logger.warning("Simulation process pool broke; replacing it and evaluating inline")
+        if _executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            await _replace_executor()
+        return _evaluate_batch(indexed, profile, load, user_id, today)
+    return [result for chunk in chunks for result in chunk]